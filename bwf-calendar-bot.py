@@ -1,146 +1,415 @@
 import requests
-from bs4 import BeautifulSoup
+from lxml import etree
+import calendar
 import datetime
-from dateutil import parser
-from dateutil.relativedelta import relativedelta
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
+from io import BytesIO
+import functools
+import random
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
 SCOPES = ['https://www.googleapis.com/auth/calendar.events', 'https://www.googleapis.com/auth/calendar.readonly']
 SERVICE_ACCOUNT_FILE = 'credentials.json'
 CALENDAR_ID = 'aecf58ddb7d31c04819a9ad9bdd718a17609f236da31215d1ce7d08861ffefdc@group.calendar.google.com'
 RESET_CALENDAR = False # Set to True to clear all events from the calendar before adding new ones
+BATCH_SIZE = 50 # Google Calendar accepts at most 50 requests per batch
+INSERT_WORKERS = 4 # batches sent concurrently when there are more than BATCH_SIZE new events
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+RATE_LIMIT_STATUSES = (429,)
+EVENT_CACHE_FILE = 'events.db' # (name, start) -> event id from earlier runs; delete it to force a full re-check
 
 URL = "https://corporate.bwfbadminton.com/events/calendar/"
 HEADERS = {
     "User-Agent": "Mozilla/5.0 (compatible; BWF-Schedule-Bot/1.0; +https://example.com/contact)"
 }
+SESSION = requests.Session()
+SESSION.headers.update(HEADERS | {"Accept-Encoding": "gzip, deflate"})
+NAME_KEYWORDS = ('sudirman', 'world championships', 'world tour finals')
+INCLUDE_CATEGORIES = ('super 300', 'super 500', 'super 750', 'super 1000')
+MONTH_IDX = {m.lower(): i for names in (calendar.month_name, calendar.month_abbr) for i, m in enumerate(names) if m}
 
-def get_authenticated_service():
-    creds = service_account.Credentials.from_service_account_file(
+@functools.lru_cache(maxsize=512)
+def _pdate(date_str):
+    tokens = date_str.split()
+    if len(tokens) == 3 and tokens[0].isdigit() and tokens[2].isdigit() and tokens[1].lower() in MONTH_IDX:
+        try:
+            return datetime.date(int(tokens[2]), MONTH_IDX[tokens[1].lower()], int(tokens[0]))
+        except ValueError:
+            pass
+    from dateutil import parser
+    return parser.parse(date_str).date()
+
+def _event_date(day_part, month, year):
+    if not any(c.isalpha() for c in day_part):
+        day_part = f"{day_part} {month}"
+    return _pdate(f"{day_part} {year}")
+
+def is_retryable(error, statuses=RETRY_STATUSES):
+    from googleapiclient.errors import HttpError
+    if not isinstance(error, HttpError):
+        return False
+    if error.resp.status == 403:
+        # Calendar reports quota exhaustion as 403 rateLimitExceeded / userRateLimitExceeded.
+        return b'ratelimitexceeded' in (error.content or b'').lower()
+    return error.resp.status in statuses
+
+def backoff_delay(attempt, base=1, max_wait=60):
+    return min(max_wait, base * 2 ** attempt) + random.uniform(0, 1)
+
+def call_with_backoff(fn, max_attempts=5, statuses=RETRY_STATUSES):
+    from googleapiclient.errors import HttpError
+    for attempt in range(max_attempts):
+        try:
+            return fn()
+        except HttpError as e:
+            if not is_retryable(e, statuses) or attempt == max_attempts - 1:
+                raise
+            time.sleep(backoff_delay(attempt))
+
+_worker_state = threading.local()
+
+@functools.lru_cache(maxsize=1)
+def load_credentials():
+    # Service account credentials refresh their own token, so one instance serves the whole process.
+    from google.oauth2 import service_account
+    return service_account.Credentials.from_service_account_file(
         SERVICE_ACCOUNT_FILE, scopes=SCOPES)
-    return build('calendar', 'v3', credentials=creds)
+
+def build_service():
+    from googleapiclient.discovery import build
+    return build('calendar', 'v3', credentials=load_credentials())
+
+@functools.lru_cache(maxsize=1)
+def get_authenticated_service():
+    return build_service()
+
+def has_class(name):
+    return f"contains(concat(' ', normalize-space(@class), ' '), ' {name} ')"
+
+NAME_XP = etree.XPath(f"(.//div[{has_class('name')}]//a)[1]")
+CELL_TEXT_XP = etree.XPath("string()")
+PRIZE_XP = etree.XPath(f"(.//*[{has_class('bwf-button_group')}]//*[{has_class('bwf-button')}])[1]")
+
+def node_text(node, separator=""):
+    return separator.join(t.strip() for t in node.itertext() if t.strip())
+
+def cell_text(cell):
+    return " ".join(CELL_TEXT_XP(cell).split())
+
+def in_calendar(elem):
+    return any(a.get('id') == 'ajaxCalender' for a in elem.iterancestors())
+
+def nearest(elem, tag):
+    return next(elem.iterancestors(tag), None)
+
+def has_class_token(elem, class_name):
+    return elem is not None and class_name in (elem.get('class') or '').split()
+
+def release(elem):
+    # Drop the finished element and everything parsed before it so the tree never holds more than a row.
+    elem.clear()
+    while elem.getprevious() is not None:
+        del elem.getparent()[0]
+
+def is_major(name, category):
+    category_l = category.lower()
+    name_l = name.lower()
+    return any(cat in category_l for cat in INCLUDE_CATEGORIES) or any(k in name_l for k in NAME_KEYWORDS)
+
+def parse_row(row, month, year):
+    cols = row.findall("td")
+    if len(cols) < 7:
+        return None
+
+    # Most rows are minor events; decide on category and name before reading anything else.
+    category = cell_text(cols[5])
+    name_tag = NAME_XP(cols[3])
+    name = node_text(name_tag[0]) if name_tag else cell_text(cols[3])
+    if not is_major(name, category):
+        return None
+
+    country, dates, city = (cell_text(col) for col in (cols[1], cols[2], cols[6]))
+
+    return {
+        "name": name,
+        "dates": dates,
+        "month": month,
+        "country": country,
+        "city": city,
+        "category": category,
+        "prize_money": None,
+        "year": year
+    }
 
 def scrape_corporate_calendar():
     try:
-        resp = requests.get(URL, headers=HEADERS, timeout=20)
+        resp = SESSION.get(URL, timeout=20)
         resp.raise_for_status()
     except requests.RequestException as e:
         print("Error fetching page:", e)
         return []
 
-    soup = BeautifulSoup(resp.text, "html.parser")
     events = []
-    
-    name_keywords = ['sudirman', 'world championships', 'world tour finals']
-    include_categories = ['super 300', 'super 500', 'super 750', 'super 1000']
     current_year = str(datetime.datetime.now().year)
+    month = None
+    month_div = None # .item-results div the current month heading came from
+    pending = None # last tournament row, waiting for its detail row
 
-    calendar_wrapper = soup.select_one("#ajaxCalender")
-    if not calendar_wrapper:
-        return events
-
-    for month_div in calendar_wrapper.select(".item-results"):
-        month_name_tag = month_div.select_one("h2")
-        if not month_name_tag:
-            continue
-        month = month_name_tag.get_text(strip=True)
+    def flush():
+        if pending is not None:
+            events.append(pending)
 
-        for row in month_div.select("table.tblResultLanding tr[class^='bg-']"):
-            cols = row.find_all("td")
-            if len(cols) < 7:
+    try:
+        for _, elem in etree.iterparse(BytesIO(resp.content), events=('end',), tag=('h2', 'tr'),
+                                       html=True, encoding=resp.encoding):
+            if not in_calendar(elem):
                 continue
 
-            country = cols[1].get_text(strip=True)
-            dates = cols[2].get_text(" ", strip=True)
-            
-            name_tag = cols[3].select_one("div.name a")
-            name = name_tag.get_text(strip=True) if name_tag else cols[3].get_text(strip=True)
-            
-            category = cols[5].get_text(strip=True)
-            city = cols[6].get_text(strip=True)
-
-            prize_money = None
-            detail_row = row.find_next_sibling("tr", class_="tr-tournament-detail")
-            if detail_row:
-                prize_tag = detail_row.select_one(".bwf-button_group .bwf-button")
-                if prize_tag:
-                    prize_money = prize_tag.get_text(" ", strip=True).replace("PRIZE MONEY", "").strip()
-            
-            is_major_by_name = any(k.lower() in name.lower() for k in name_keywords)
-            is_major_by_category = any(cat.lower() in category.lower() for cat in include_categories)
-
-            if is_major_by_category or is_major_by_name:
-                events.append({
-                    "name": name,
-                    "dates": dates,
-                    "month": month,
-                    "country": country,
-                    "city": city,
-                    "category": category,
-                    "prize_money": prize_money,
-                    "year": current_year
-                })
+            # Headings and rows nested inside a detail cell belong to that cell: leave them for
+            # PRIZE_XP and don't release them, or the enclosing row loses its content.
+            if elem.tag == 'h2':
+                if nearest(elem, 'tr') is not None:
+                    continue
+                div = next((a for a in elem.iterancestors('div') if has_class_token(a, 'item-results')), None)
+                if div is None or div is month_div:
+                    continue
+                flush()
+                pending = None
+                month_div = div
+                month = node_text(elem)
+            else:
+                if nearest(elem, 'tr') is not None or not has_class_token(nearest(elem, 'table'), 'tblResultLanding'):
+                    continue
+                row_class = elem.get('class') or ''
+                if row_class.startswith('bg-') and month:
+                    flush()
+                    pending = parse_row(elem, month, current_year)
+                elif 'tr-tournament-detail' in row_class.split() and pending is not None:
+                    prize_tag = PRIZE_XP(elem)
+                    if prize_tag:
+                        pending['prize_money'] = node_text(prize_tag[0], " ").replace("PRIZE MONEY", "").strip()
+                    flush()
+                    pending = None
+            release(elem)
+    except etree.XMLSyntaxError as e:
+        # An empty or truncated page; keep whatever was read before it.
+        print("Error parsing page:", e)
+    flush()
 
     return events
 
-def clear_calendar(service):
+def normalize_name(name):
+    # Case, punctuation and spacing vary between runs and manual edits; compare on letters and digits only.
+    return re.sub(r'[\W_]+', '', name.lower())
+
+def open_event_cache(path=EVENT_CACHE_FILE):
+    cache = sqlite3.connect(path)
+    cache.execute("CREATE TABLE IF NOT EXISTS events(name TEXT, start DATE, id TEXT, PRIMARY KEY(name, start))")
+    return cache
+
+def cached_event_id(cache, name, start_date):
+    row = cache.execute("SELECT id FROM events WHERE name=? AND start=?", (normalize_name(name), start_date.isoformat())).fetchone()
+    return row[0] if row else None
+
+def cache_event(cache, name, start_date, event_id):
+    with cache:
+        cache.execute("INSERT OR REPLACE INTO events VALUES (?, ?, ?)", (normalize_name(name), start_date.isoformat(), event_id))
+
+def clear_calendar(service, cache=None):
     print("Clearing all events from the calendar...")
     page_token = None
     while True:
-        events = service.events().list(calendarId=CALENDAR_ID, pageToken=page_token).execute()
+        events = call_with_backoff(service.events().list(calendarId=CALENDAR_ID, pageToken=page_token).execute)
         for event in events['items']:
             try:
-                service.events().delete(calendarId=CALENDAR_ID, eventId=event['id']).execute()
+                call_with_backoff(service.events().delete(calendarId=CALENDAR_ID, eventId=event['id']).execute)
                 print(f"Deleted: {event.get('summary', 'Unknown Event')}")
             except Exception as e:
                 print(f"Error deleting event {event.get('summary', 'N/A')}: {e}")
         page_token = events.get('nextPageToken')
         if not page_token:
             break
+    if cache is not None:
+        with cache:
+            cache.execute("DELETE FROM events")
     print("Calendar has been cleared.")
 
-def create_calendar_events(events, service):
+def parse_event_dates(event_data):
+    dates = " ".join(event_data['dates'].split())
+    date_parts = dates.split('-')
+    
+    if len(date_parts) > 1:
+        start_part = date_parts[0].strip()
+        end_part = date_parts[1].strip()
+        
+        start_date = _event_date(start_part, event_data['month'], event_data['year'])
+        end_date = _event_date(end_part, event_data['month'], event_data['year'])
+        
+        if end_date < start_date:
+            from dateutil.relativedelta import relativedelta
+            # "30 Dec - 04 Jan" crosses the year; a day-only end like "30 - 02" crosses the month.
+            if any(c.isalpha() for c in end_part):
+                end_date += relativedelta(years=1)
+            else:
+                end_date += relativedelta(months=1)
+    
+    else:
+        start_date = _event_date(dates, event_data['month'], event_data['year'])
+        end_date = start_date
+
+    return start_date, end_date
+
+def event_key(summary):
+    # Summaries are "<name> (<category>)"; index on the name part.
+    if summary.endswith(')') and ' (' in summary:
+        summary = summary.rsplit(' (', 1)[0]
+    return normalize_name(summary)
+
+def fetch_existing_events(service, time_min, time_max):
+    existing = {}
+    page_token = None
+    while True:
+        response = call_with_backoff(service.events().list(
+            calendarId=CALENDAR_ID,
+            timeMin=time_min.isoformat() + 'T00:00:00Z',
+            timeMax=time_max.isoformat() + 'T00:00:00Z',
+            singleEvents=True,
+            maxResults=2500,
+            pageToken=page_token
+        ).execute)
+        for item in response.get('items', []):
+            start = item['start'].get('date') or item['start'].get('dateTime', '')[:10]
+            end = item['end'].get('date') or item['end'].get('dateTime', '')[:10]
+            existing.setdefault(event_key(item.get('summary', '')), []).append((start, end, item.get('id')))
+        page_token = response.get('nextPageToken')
+        if not page_token:
+            break
+    return existing
+
+def find_existing_event(existing, name, start_date, end_date_exclusive):
+    start, end = start_date.isoformat(), end_date_exclusive.isoformat()
+    for entry in existing.get(normalize_name(name), ()):
+        if entry[0] < end and entry[1] > start:
+            return entry
+    return None
+
+def worker_service():
+    # googleapiclient services share one httplib2.Http, which is not thread-safe.
+    if not hasattr(_worker_state, 'service'):
+        _worker_state.service = build_service()
+    return _worker_state.service
+
+def insert_batch(service, pending, request_ids, max_attempts=5):
+    results = {}
+    retry = []
+
+    def on_insert(request_id, response, exception):
+        # A sub-request 5xx may still have been applied, so like the batch itself it is only reported.
+        if exception is not None and is_retryable(exception, RATE_LIMIT_STATUSES):
+            retry.append(request_id)
+        elif exception is not None and is_retryable(exception):
+            results[request_id] = (None, f"event may or may not have been created: {exception}")
+        else:
+            results[request_id] = (response, exception)
+
+    for attempt in range(max_attempts):
+        if attempt:
+            time.sleep(backoff_delay(attempt - 1))
+        retry.clear()
+        batch = service.new_batch_http_request(callback=on_insert)
+        for request_id in request_ids:
+            batch.add(service.events().insert(calendarId=CALENDAR_ID, body=pending[int(request_id)][3]),
+                      request_id=request_id)
+        try:
+            # Inserts are not idempotent: after a 5xx the server may have applied part of the batch,
+            # so only rate-limit rejections are resent. Anything created is found by the next run's lookup.
+            call_with_backoff(batch.execute, max_attempts=max_attempts, statuses=RATE_LIMIT_STATUSES)
+        except Exception as e:
+            if is_retryable(e, RATE_LIMIT_STATUSES):
+                # A rate-limited batch was rejected outright; nothing in it was created.
+                for request_id in request_ids:
+                    results.setdefault(request_id, (None, f"still rate limited after {max_attempts} attempts"))
+                break
+            for request_id in request_ids:
+                results.setdefault(request_id, (None, f"batch failed, event may or may not have been created: {e}"))
+            break
+        if not retry:
+            break
+        request_ids = list(retry)
+    else:
+        for request_id in retry:
+            results[request_id] = (None, f"still rate limited after {max_attempts} attempts")
+    return results
+
+def insert_events(service, pending, cache=None, workers=INSERT_WORKERS):
+    chunks = [[str(i) for i in range(offset, min(offset + BATCH_SIZE, len(pending)))]
+              for offset in range(0, len(pending), BATCH_SIZE)]
+    if len(chunks) <= 1 or workers <= 1:
+        batch_results = [insert_batch(service, pending, chunk) for chunk in chunks]
+    else:
+        batch_results = []
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(lambda chunk: insert_batch(worker_service(), pending, chunk), chunk): chunk
+                       for chunk in chunks}
+            # One failed worker must not hide the batches that did go through.
+            for future in as_completed(futures):
+                try:
+                    batch_results.append(future.result())
+                except Exception as e:
+                    batch_results.append({request_id: (None, f"insert worker failed: {e}") for request_id in futures[future]})
+
+    # Report and cache from this thread only; the SQLite connection is not shared with the workers.
+    for results in batch_results:
+        for request_id in sorted(results, key=int):
+            response, exception = results[request_id]
+            event_data, start_date, end_date, _ = pending[int(request_id)]
+            if exception is not None:
+                print(f"Error creating event '{event_data['name']}': {exception}")
+                continue
+            if cache is not None:
+                cache_event(cache, event_data['name'], start_date, response['id'])
+            print(f"Created: {event_data['name']} ({start_date} - {end_date})")
+
+def create_calendar_events(events, service, cache=None):
     print("Creating Google Calendar events...")
+    parsed_events = []
     for event_data in events:
         try:
-            date_str = f"{event_data['dates']} {event_data['month']} {event_data['year']}"
-            date_str = " ".join(date_str.split())
-            date_parts = date_str.split('-')
-            
-            if len(date_parts) > 1:
-                start_part = date_parts[0].strip()
-                end_part = date_parts[1].strip()
-                
-                start_date_str = f"{start_part} {event_data['month']} {event_data['year']}"
-                start_date = parser.parse(start_date_str).date()
-
-                if not any(c.isalpha() for c in end_part):
-                    end_date_str = f"{end_part} {event_data['month']} {event_data['year']}"
-                    end_date = parser.parse(end_date_str).date()
-                else:
-                    end_date_str = f"{end_part} {event_data['year']}"
-                    end_date = parser.parse(end_date_str).date()
-                
-                if end_date < start_date:
-                    end_date += relativedelta(months=1)
-            
-            else:
-                start_date = parser.parse(date_str).date()
-                end_date = start_date
+            start_date, end_date = parse_event_dates(event_data)
+        except Exception as e:
+            print(f"Error creating event '{event_data['name']}': {e}")
+            continue
+        if cache is not None and cached_event_id(cache, event_data['name'], start_date):
+            print(f"Skipping: '{event_data['name']}' already exists.")
+            continue
+        parsed_events.append((event_data, start_date, end_date))
 
-            end_date_exclusive = end_date + datetime.timedelta(days=1)
+    if not parsed_events:
+        print("\nNo new events to create.")
+        return
 
-            existing_events = service.events().list(
-                calendarId=CALENDAR_ID,
-                q=event_data['name'],
-                timeMin=start_date.isoformat() + 'T00:00:00Z',
-                timeMax=end_date_exclusive.isoformat() + 'T00:00:00Z',
-                singleEvents=True,
-                orderBy='startTime'
-            ).execute()
+    try:
+        existing = fetch_existing_events(
+            service,
+            min(start for _, start, _ in parsed_events),
+            max(end for _, _, end in parsed_events) + datetime.timedelta(days=1)
+        )
+    except Exception as e:
+        print(f"Error fetching existing events: {e}")
+        return
 
-            if existing_events.get('items'):
+    pending = []
+    for event_data, start_date, end_date in parsed_events:
+        try:
+            end_date_exclusive = end_date + datetime.timedelta(days=1)
+
+            match = find_existing_event(existing, event_data['name'], start_date, end_date_exclusive)
+            if match:
+                if cache is not None and match[2]:
+                    cache_event(cache, event_data['name'], start_date, match[2])
                 print(f"Skipping: '{event_data['name']}' already exists.")
                 continue
 
@@ -154,23 +423,27 @@ def create_calendar_events(events, service):
                 'end': {'date': end_date_exclusive.isoformat()},
             }
 
-            service.events().insert(calendarId=CALENDAR_ID, body=event).execute()
-            print(f"Created: {event_data['name']} ({start_date} - {end_date})")
+            existing.setdefault(event_key(event['summary']), []).append(
+                (event['start']['date'], event['end']['date'], None))
+            pending.append((event_data, start_date, end_date, event))
 
         except Exception as e:
             print(f"Error creating event '{event_data['name']}': {e}")
+
+    insert_events(service, pending, cache)
     print("\nAll new events have been successfully created.")
 
 if __name__ == '__main__':
     try:
         service = get_authenticated_service()
+        cache = open_event_cache()
 
         if RESET_CALENDAR:
-            clear_calendar(service)
+            clear_calendar(service, cache)
 
         tournaments = scrape_corporate_calendar()
         if tournaments:
-            create_calendar_events(tournaments, service)
+            create_calendar_events(tournaments, service, cache)
         else:
             print("No tournaments found that match the criteria.")
     except Exception as e: